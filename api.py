@@ -5,10 +5,8 @@ import datetime
 import hashlib
 import json
 import logging
+import threading
 # from scoring import get_score, get_interests
-import uuid
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from optparse import OptionParser
 
 import scoring
 from field import (
@@ -20,9 +18,10 @@ from req import (
     MethodRequest,
     OnlineScoreRequest,
     ClientsInterestsRequest,
+    ClientsByInterestsRequest,
     RequestValidationFailedError,
 )
-from store import Store, Storage
+from store import Store, Storage, OVERFLOWS, OVERFLOW_BLOCK
 
 SALT = "Otus"
 ADMIN_SALT = "42"
@@ -39,6 +38,7 @@ ERRORS = {
     INVALID_REQUEST: "Invalid Request",
     INTERNAL_ERROR: "Internal Server Error",
 }
+DEFAULT_COUNT = 100
 
 
 def check_auth(request):
@@ -84,10 +84,25 @@ def clients_interests_handler(request, ctx, store):
     return interests, OK
 
 
+def clients_by_interests_handler(request, ctx, store):
+    clients_by_interests_request = ClientsByInterestsRequest()
+    clients_by_interests_request.validate(request.arguments)
+    client_ids, cursor = scoring.get_clients_by_interests(
+        store,
+        clients_by_interests_request.interests,
+        clients_by_interests_request.operator == "or",
+        clients_by_interests_request.cursor,
+        clients_by_interests_request.count or DEFAULT_COUNT,
+    )
+    ctx["ninterests"] = len(clients_by_interests_request.interests)
+    return {"client_ids": client_ids, "cursor": cursor}, OK
+
+
 def method_handler(request, ctx, store):
     methods = {
         "online_score": online_score_handler,
         "clients_interests": clients_interests_handler,
+        "clients_by_interests": clients_by_interests_handler,
     }
     try:
         method_request = MethodRequest()
@@ -104,60 +119,132 @@ def method_handler(request, ctx, store):
     return response, code
 
 
-class MainHTTPHandler(BaseHTTPRequestHandler):
-    router = {
-        "method": method_handler
-    }
-    store = Store(Storage())
-    store.connect()
-
-    def get_request_id(self, headers):
-        return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
-
-    def do_POST(self):
-        response, code = {}, OK
-        context = {"request_id": self.get_request_id(self.headers)}
-        request = None
-        try:
-            data_string = self.rfile.read(int(self.headers['Content-Length']))
-            request = json.loads(data_string)
-        except (IOError, json.JSONDecodeError):
-            code = BAD_REQUEST
-        if request:
-            path = self.path.strip("/")
-            logging.info("%s: %s %s", self.path, data_string, context["request_id"])
-            if path in self.router:
+_main_handler = None
+
+
+def get_main_handler():
+    # http.server is only needed to serve requests, so the handler class
+    # is built on first use instead of at import time
+    global _main_handler
+    if _main_handler is None:
+        from http.server import BaseHTTPRequestHandler
+
+        class MainHTTPHandler(BaseHTTPRequestHandler):
+            router = {
+                "method": method_handler
+            }
+            store = None
+            profiler = None
+            store_lock = threading.Lock()
+
+            def get_store(self):
+                # handlers built without create_app() get a store of their own on first request
+                cls = type(self)
+                if cls.store is None:
+                    with cls.store_lock:
+                        if cls.store is None:
+                            cls.store = Store(Storage())
+                return cls.store
+
+            def get_request_id(self, headers):
+                import uuid
+                return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
+
+            def do_POST(self):
+                context = {"request_id": self.get_request_id(self.headers)}
+                if self.profiler is None:
+                    return self.handle_post(context)
+                with self.profiler.profile(context["request_id"], self.headers):
+                    self.handle_post(context)
+
+            def handle_post(self, context):
+                response, code = {}, OK
+                request = None
                 try:
-                    response, code = self.router[path]({"body": request, "headers": self.headers}, context, self.store)
-                except Exception as e:
-                    logging.exception("Unexpected error: %s", e)
-                    code = INTERNAL_ERROR
-            else:
-                code = NOT_FOUND
-
-        self.send_response(code)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        if code not in ERRORS:
-            r = {"response": response, "code": code}
-        else:
-            r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
-        context.update(r)
-        logging.info(context)
-        self.wfile.write(json.dumps(r).encode("utf-8"))
+                    data_string = self.rfile.read(int(self.headers['Content-Length']))
+                    request = json.loads(data_string)
+                except (IOError, json.JSONDecodeError):
+                    code = BAD_REQUEST
+                if request:
+                    path = self.path.strip("/")
+                    logging.info("%s: %s %s", self.path, data_string, context["request_id"])
+                    if path in self.router:
+                        try:
+                            response, code = self.router[path]({"body": request, "headers": self.headers}, context, self.get_store())
+                        except Exception as e:
+                            logging.exception("Unexpected error: %s", e)
+                            code = INTERNAL_ERROR
+                    else:
+                        code = NOT_FOUND
+
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                if code not in ERRORS:
+                    r = {"response": response, "code": code}
+                else:
+                    r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
+                context.update(r)
+                logging.info(context)
+                self.wfile.write(json.dumps(r).encode("utf-8"))
+
+        _main_handler = MainHTTPHandler
+    return _main_handler
+
+
+def __getattr__(name):
+    if name == "MainHTTPHandler":
+        return get_main_handler()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def create_app(store=None, profiler=None):
+    """Build a handler class bound to its own store, call it once per worker process."""
+    if store is None:
+        store = Store(Storage())
+    return type("MainHTTPHandler", (get_main_handler(),), {"store": store, "profiler": profiler})
 
 
 if __name__ == "__main__":
+    from http.server import HTTPServer
+    from optparse import OptionParser
+
+    from profiling import MODES, MODE_SAMPLE, Profiler
+
     op = OptionParser()
     op.add_option("-p", "--port", action="store", type=int, default=8080)
     op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("--write-behind", action="store_true", default=False,
+                  help="queue Redis writes and flush them in batches")
+    op.add_option("--flush-interval", action="store", type=float, default=0.05)
+    op.add_option("--write-queue-size", action="store", type=int, default=10000)
+    op.add_option("--write-overflow", action="store", choices=OVERFLOWS, default=OVERFLOW_BLOCK)
+    op.add_option("--profile-dir", action="store", default=None,
+                  help="enable per-request profiling, write profiles to this directory")
+    op.add_option("--profile-rate", action="store", type=float, default=0.0,
+                  help="fraction of requests to profile")
+    op.add_option("--profile-token", action="store", default=None,
+                  help="also profile requests whose X-Profile header carries this token")
+    op.add_option("--profile-mode", action="store", choices=MODES, default=MODE_SAMPLE)
+    op.add_option("--profile-max-bytes", action="store", type=int, default=50 * 1024 * 1024)
     (opts, args) = op.parse_args()
     logging.basicConfig(filename=opts.log, level=logging.INFO,
                         format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
-    server = HTTPServer(("localhost", opts.port), MainHTTPHandler)
+    store = Store(Storage())
+    if opts.write_behind:
+        store.enable_write_behind(max_size=opts.write_queue_size, flush_interval=opts.flush_interval,
+                                  overflow=opts.write_overflow)
+    profiler = None
+    if opts.profile_dir:
+        profiler = Profiler(opts.profile_dir, opts.profile_rate, opts.profile_mode,
+                            max_bytes=opts.profile_max_bytes, header_token=opts.profile_token)
+    server = HTTPServer(("localhost", opts.port), create_app(store, profiler))
     logging.info("Starting server at %s", opts.port)
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         pass
     server.server_close()
+    store.close()
+    if profiler is not None:
+        profiler.close()
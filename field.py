@@ -9,6 +9,7 @@ GENDERS = {
     FEMALE: "female",
 }
 NULLABLE = ['', {}, (), [], None]
+MAX_COUNT = 1000
 
 class FieldEmptyValueError(Exception):
 
@@ -134,3 +135,29 @@ class ClientIDsField(Field):
     def _validate(self):
         if not all([isinstance(item, int) for item in self._value]):
             raise FieldValidationError("ClientIDs must be a list of int")
+
+
+class InterestsField(Field):
+    _type = list
+
+    def _validate(self):
+        if not all([isinstance(item, str) and item for item in self._value]):
+            raise FieldValidationError("Interests must be a list of non-empty str")
+
+
+class CursorField(Field):
+    _type = int
+
+
+class CountField(Field):
+    _type = int
+
+    def validate(self):
+        super().validate()
+        # Field.validate skips falsy values, but 0 is not a valid count
+        if self._value == 0:
+            self._validate()
+
+    def _validate(self):
+        if not 0 < self._value <= MAX_COUNT:
+            raise FieldValidationError("Count must be in range 1..{}, but got '{}'".format(MAX_COUNT, self._value))
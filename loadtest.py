@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from http.client import HTTPConnection
+from http.server import HTTPServer
+from multiprocessing import Event, Process, Queue
+from concurrent.futures import ProcessPoolExecutor
+from optparse import OptionParser
+
+import fakeredis
+import redis
+
+import api
+import field
+import req
+import scoring
+from profiling import Profiler
+from store import Store, Storage
+
+INTERESTS = ["cars", "pets", "travel", "hi-tech", "sport", "music",
+             "books", "tv", "cinema", "geek", "otus"]
+KINDS = ("online_score", "clients_interests", "clients_by_interests", "admin")
+DEFAULT_MIX = "online_score=6,clients_interests=3,clients_by_interests=1,admin=1"
+PERCENTILES = (50, 90, 95, 99)
+ADMIN_SCORE = int(api.ADMIN_SALT)
+# every request carries all scoring fields, see make_request
+FULL_SCORE = 5.0
+BAD_RESPONSE = "bad response"
+# cold start budget for "import api" in a fresh interpreter, seconds
+COLD_START_BUDGET = 0.1
+COLD_START = "import time; started = time.perf_counter(); import api; print(time.perf_counter() - started)"
+
+
+class FlakyRedis:
+    """Redis client proxy that injects latency and connection failures."""
+
+    def __init__(self, client, latency=0.0, failure_rate=0.0):
+        self.client = client
+        self.latency = latency
+        self.failure_rate = failure_rate
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+
+        def wrapper(*args, **kwargs):
+            self.inject()
+            result = attr(*args, **kwargs)
+            if name == "pipeline":
+                # pipelined commands reach Redis on execute, inject there as well
+                result = FlakyPipeline(result, self)
+            return result
+        return wrapper
+
+    def inject(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise redis.exceptions.ConnectionError("Injected Redis failure")
+
+
+class FlakyPipeline:
+    """Redis pipeline proxy that injects latency and failures on execute."""
+
+    def __init__(self, pipeline, flaky):
+        self.pipeline = pipeline
+        self.flaky = flaky
+
+    def __getattr__(self, name):
+        return getattr(self.pipeline, name)
+
+    def execute(self, *args, **kwargs):
+        self.flaky.inject()
+        return self.pipeline.execute(*args, **kwargs)
+
+
+class QuietHTTPHandler(api.MainHTTPHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Stats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.codes = defaultdict(Counter)
+        self.started = None
+        self.finished = None
+
+    def add(self, kind, latency, code):
+        with self.lock:
+            self.latencies[kind].append(latency)
+            self.codes[kind][code] += 1
+
+    def update(self, results):
+        for kind, latency, code in results:
+            self.add(kind, latency, code)
+
+    @property
+    def duration(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def total(self, kind=None):
+        kinds = [kind] if kind else self.codes.keys()
+        return sum(sum(self.codes[k].values()) for k in kinds)
+
+    def errors(self, kind=None):
+        kinds = [kind] if kind else self.codes.keys()
+        return sum(n for k in kinds for code, n in self.codes[k].items() if code != api.OK)
+
+    def report(self):
+        total = self.total()
+        lines = [
+            "Requests: {} in {:.2f}s ({:.1f} req/s)".format(total, self.duration, total / self.duration),
+            "Errors: {} ({:.2%})".format(self.errors(), self.errors() / total if total else 0),
+        ]
+        all_latencies = [latency for values in self.latencies.values() for latency in values]
+        for kind in ["all"] + sorted(self.latencies):
+            latencies = all_latencies if kind == "all" else self.latencies[kind]
+            parts = ["p{}={:.1f}ms".format(p, percentile(latencies, p) * 1000) for p in PERCENTILES]
+            parts.append("max={:.1f}ms".format(max(latencies, default=0) * 1000))
+            lines.append("{:>20}: {}".format(kind, " ".join(parts)))
+        for kind in sorted(self.codes):
+            codes = ", ".join("{}: {}".format(code, n) for code, n in sorted(self.codes[kind].items(), key=str))
+            lines.append("{:>20}: errors {:.2%} ({})".format(
+                kind, self.errors(kind) / self.total(kind), codes))
+        return "\n".join(lines)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = max(math.ceil(p / 100.0 * len(values)) - 1, 0)
+    return values[index]
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(","):
+        kind, _, weight = item.partition("=")
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError("Unknown request kind '{}', expected one of {}".format(kind, KINDS))
+        weights[kind] = float(weight or 1)
+    return weights
+
+
+def sign(request):
+    if request["login"] == req.ADMIN_LOGIN:
+        auth = datetime.datetime.now().strftime("%Y%m%d%H") + api.ADMIN_SALT
+    else:
+        auth = request["account"] + request["login"] + api.SALT
+    request["token"] = hashlib.sha512(auth.encode("utf-8")).hexdigest()
+    return request
+
+
+def make_request(kind, clients, max_client_ids):
+    request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score"}
+    if kind == "clients_interests":
+        request["method"] = "clients_interests"
+        size = min(random.randint(1, max_client_ids), clients)
+        request["arguments"] = {
+            "client_ids": random.sample(range(clients), size),
+            "date": datetime.date.today().strftime("%d.%m.%Y"),
+        }
+    elif kind == "clients_by_interests":
+        request["method"] = "clients_by_interests"
+        request["arguments"] = {
+            "interests": random.sample(INTERESTS, random.randint(1, 2)),
+            "operator": random.choice(req.OPERATORS),
+            "count": max_client_ids,
+        }
+    else:
+        if kind == "admin":
+            request["login"] = req.ADMIN_LOGIN
+        request["arguments"] = {
+            "phone": "7%010d" % random.randrange(10 ** 10),
+            "email": "user%i@otus.ru" % random.randrange(clients),
+            "first_name": random.choice(["a", "b", "c"]),
+            "last_name": random.choice(["x", "y", "z"]),
+            "gender": random.choice([field.MALE, field.FEMALE]),
+            "birthday": "01.01.%i" % random.randint(1970, 2005),
+        }
+    return sign(request)
+
+
+def seeded_interests(cid):
+    return random.Random(cid).sample(INTERESTS, 2)
+
+
+def make_store(clients, redis_port=None, latency=0.0, failure_rate=0.0):
+    store = Store(Storage())
+    if redis_port:
+        store.port = redis_port
+        store.connect()
+    else:
+        store.redis = fakeredis.FakeRedis()
+    for cid in range(clients):
+        scoring.set_interests(store, cid, seeded_interests(cid))
+    store.redis = FlakyRedis(store.redis, latency, failure_rate)
+    return store
+
+
+def check_response(request, response):
+    """Return True if the response body matches the seeded data."""
+    arguments = request["arguments"]
+    if request["method"] == "online_score":
+        expected = ADMIN_SCORE if request["login"] == req.ADMIN_LOGIN else FULL_SCORE
+        return response == {"score": expected}
+    if request["method"] == "clients_interests":
+        return response == {str(cid): seeded_interests(cid) for cid in arguments["client_ids"]}
+    client_ids = response["client_ids"]
+    match = any if arguments["operator"] == "or" else all
+    return (
+        len(client_ids) <= arguments["count"]
+        and client_ids == sorted(client_ids)
+        and all(match(i in seeded_interests(cid) for i in arguments["interests"]) for cid in client_ids)
+    )
+
+
+def serve(opts, addresses, stop):
+    """Run api.py's single-threaded HTTPServer until stop is set."""
+    store = make_store(opts.clients, opts.redis_port, opts.redis_latency / 1000.0, opts.redis_failure_rate)
+    profiler = Profiler(opts.profile_dir, opts.profile_rate) if opts.profile_dir else None
+    handler = type("LoadTestHTTPHandler", (QuietHTTPHandler,), {"store": store, "profiler": profiler})
+    server = HTTPServer(("localhost", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    addresses.put(server.server_address)
+    stop.wait()
+    server.shutdown()
+    server.server_close()
+    store.close()
+    if profiler is not None:
+        profiler.close()
+
+
+def start_server(opts):
+    addresses, stop = Queue(), Event()
+    process = Process(target=serve, args=(opts, addresses, stop), daemon=True)
+    process.start()
+    return process, addresses.get(), stop
+
+
+def worker(address, weights, deadline, opts):
+    results = []
+    kinds = list(weights)
+    while time.monotonic() < deadline:
+        kind = random.choices(kinds, weights=list(weights.values()))[0]
+        request = make_request(kind, opts.clients, opts.max_client_ids)
+        started = time.monotonic()
+        try:
+            conn = HTTPConnection(*address, timeout=opts.timeout)
+            conn.request("POST", "/method/", json.dumps(request), {"Content-Type": "application/json"})
+            body = json.loads(conn.getresponse().read())
+            conn.close()
+            code = body.get("code")
+            if code == api.OK and not check_response(request, body.get("response")):
+                code = BAD_RESPONSE
+        except Exception as e:
+            code = type(e).__name__
+        results.append((kind, time.monotonic() - started, code))
+    return results
+
+
+def load_process(address, weights, deadline, opts, connections):
+    """Generate load from a separate process over several connections."""
+    threads, results = [], []
+    for _ in range(connections):
+        thread = threading.Thread(target=lambda: results.extend(worker(address, weights, deadline, opts)))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def run(opts):
+    weights = parse_mix(opts.mix)
+    server, address, stop = start_server(opts)
+    processes = max(min(opts.processes, opts.concurrency), 1)
+    stats = Stats()
+    try:
+        with ProcessPoolExecutor(processes) as executor:
+            stats.started = time.monotonic()
+            deadline = stats.started + opts.duration
+            futures = [
+                executor.submit(load_process, address, weights, deadline, opts,
+                                opts.concurrency // processes + (i < opts.concurrency % processes))
+                for i in range(processes)
+            ]
+            for future in futures:
+                stats.update(future.result())
+            stats.finished = time.monotonic()
+    finally:
+        stop.set()
+        server.join()
+    return stats
+
+
+def measure_cold_start(runs=5):
+    """Return the best "import api" time over several fresh interpreters."""
+    root = os.path.dirname(os.path.abspath(__file__))
+    return min(
+        float(subprocess.check_output([sys.executable, "-c", COLD_START], cwd=root, text=True))
+        for _ in range(runs)
+    )
+
+
+def get_option_parser():
+    op = OptionParser(description="Drive api.py under load against a local Redis stand-in")
+    op.add_option("-c", "--concurrency", action="store", type=int, default=32, help="concurrent connections")
+    op.add_option("-P", "--processes", action="store", type=int, default=4,
+                  help="load generator processes, connections are spread among them")
+    op.add_option("-d", "--duration", action="store", type=float, default=10.0, help="seconds")
+    op.add_option("-m", "--mix", action="store", default=DEFAULT_MIX,
+                  help="request weights, e.g. '%s'" % DEFAULT_MIX)
+    op.add_option("--clients", action="store", type=int, default=10000, help="number of seeded client ids")
+    op.add_option("--max-client-ids", action="store", type=int, default=50,
+                  help="maximum client_ids per clients_interests request")
+    op.add_option("--redis-port", action="store", default=None,
+                  help="use a local redis-server on this port instead of fakeredis")
+    op.add_option("--redis-latency", action="store", type=float, default=0.0,
+                  help="injected latency per Redis call, ms")
+    op.add_option("--redis-failure-rate", action="store", type=float, default=0.0,
+                  help="probability of an injected Redis connection failure")
+    op.add_option("--profile-dir", action="store", default=None,
+                  help="profile sampled requests, write collapsed stacks to this directory")
+    op.add_option("--profile-rate", action="store", type=float, default=0.01,
+                  help="fraction of requests to profile")
+    op.add_option("--timeout", action="store", type=float, default=10.0, help="client timeout, seconds")
+    op.add_option("--cold-start", action="store_true", default=False,
+                  help="measure the api.py cold start against its budget instead of running load")
+    op.add_option("-l", "--log", action="store", default=None)
+    return op
+
+
+if __name__ == "__main__":
+    (opts, args) = get_option_parser().parse_args()
+    logging.basicConfig(filename=opts.log, level=logging.WARNING,
+                        format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
+    if opts.cold_start:
+        elapsed = measure_cold_start()
+        print("Cold start: {:.1f}ms, budget {:.1f}ms".format(elapsed * 1000, COLD_START_BUDGET * 1000))
+        sys.exit(elapsed > COLD_START_BUDGET)
+    print(run(opts).report())
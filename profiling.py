@@ -0,0 +1,245 @@
+import cProfile
+import hashlib
+import hmac
+import logging
+import marshal
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+PROFILE_HEADER = "X-Profile"
+MODE_SAMPLE = "sample"
+MODE_CPROFILE = "cprofile"
+MODES = (MODE_SAMPLE, MODE_CPROFILE)
+AGGREGATE_FILE = "profile.collapsed"
+TRUNCATED = "[truncated]"
+REQUEST_ID_RE = re.compile(r"^[\w-]{1,64}$")
+PROFILE_SUFFIXES = (".collapsed", ".prof")
+
+
+def collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append("%s:%s" % (os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def format_collapsed(stacks):
+    return "".join("%s %i\n" % (stack, count) for stack, count in sorted(stacks.items())).encode("utf-8")
+
+
+class Profiler:
+    """Opt-in per-request profiler.
+
+    A request is profiled when it is picked with probability rate, or when
+    header_token is set and the X-Profile header carries it. In "sample" mode a background thread samples the
+    stacks of profiled requests every interval seconds, and the samples are
+    written as collapsed stacks per request and aggregated in profile.collapsed.
+    In "cprofile" mode a pstats file is written per request.
+
+    Profiling is skipped once max_concurrent requests are being profiled or
+    once it has cost more than max_overhead of the last overhead_window
+    seconds. Profile files in path, including those left by earlier runs,
+    are kept under max_bytes by deleting the oldest per-request files.
+    """
+
+    def __init__(self, path, rate=0.0, mode=MODE_SAMPLE, interval=0.001, max_concurrent=4,
+                 max_overhead=0.05, overhead_window=10.0, max_bytes=50 * 1024 * 1024, max_stacks=10000,
+                 aggregate_interval=10.0, header_token=None):
+        if mode not in MODES:
+            raise ValueError("Profiling mode must be one of {}, but got '{}'".format(MODES, mode))
+        self.path = path
+        self.rate = rate
+        self.mode = mode
+        self.interval = interval
+        # only one cProfile profiler can be active at a time
+        self.max_concurrent = 1 if mode == MODE_CPROFILE else max_concurrent
+        self.max_overhead = max_overhead
+        self.overhead_window = overhead_window
+        self.header_token = header_token
+        self.max_bytes = max_bytes
+        self.max_stacks = max_stacks
+        self.aggregate_interval = aggregate_interval
+        self.overhead = 0.0
+        # per-second overhead buckets of the sliding window
+        self.overhead_buckets = deque()
+        self.aggregate_written_at = None
+        self.stacks = Counter()
+        self.active = {}
+        # cond guards the counters above, write_lock serializes file writes and the disk budget
+        self.cond = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.stopped = False
+        self.sampler = None
+        os.makedirs(path, exist_ok=True)
+        self.files = deque(self.list_files())
+        self.bytes_written = sum(size for _, size in self.files)
+        aggregate = os.path.join(path, AGGREGATE_FILE)
+        self.aggregate_size = os.path.getsize(aggregate) if os.path.exists(aggregate) else 0
+        self.bytes_written += self.aggregate_size
+
+    def list_files(self):
+        """Return (name, size) of per-request profiles in path, oldest first."""
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.is_file() and entry.name.endswith(PROFILE_SUFFIXES):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        return [(name, size) for _, name, size in sorted(files)]
+
+    def add_overhead(self, seconds):
+        now = int(time.monotonic())
+        self.overhead += seconds
+        if self.overhead_buckets and self.overhead_buckets[-1][0] == now:
+            self.overhead_buckets[-1][1] += seconds
+        else:
+            self.overhead_buckets.append([now, seconds])
+
+    def window_overhead(self):
+        oldest = time.monotonic() - self.overhead_window
+        while self.overhead_buckets and self.overhead_buckets[0][0] < oldest:
+            self.overhead_buckets.popleft()
+        return sum(seconds for _, seconds in self.overhead_buckets)
+
+    def is_forced(self, headers):
+        value = headers.get(PROFILE_HEADER) if headers and self.header_token else None
+        return bool(value) and hmac.compare_digest(value, self.header_token)
+
+    def should_profile(self, forced):
+        if not forced and random.random() >= self.rate:
+            return False
+        if len(self.active) >= self.max_concurrent:
+            return False
+        return self.window_overhead() <= self.max_overhead * self.overhead_window
+
+    @contextmanager
+    def profile(self, request_id, headers=None):
+        thread_id = threading.get_ident()
+        forced = self.is_forced(headers)
+        with self.cond:
+            enabled = self.should_profile(forced)
+            if enabled:
+                self.active[thread_id] = Counter()
+                self.cond.notify_all()
+        if not enabled:
+            yield
+            return
+        if not REQUEST_ID_RE.match(request_id):
+            request_id = hashlib.md5(request_id.encode("utf-8")).hexdigest()
+        try:
+            if self.mode == MODE_CPROFILE:
+                with self.cprofile(request_id):
+                    yield
+            else:
+                self.start_sampler()
+                yield
+        finally:
+            with self.cond:
+                stacks = self.active.pop(thread_id)
+                self.merge(stacks)
+            if stacks:
+                self.write("%s.collapsed" % request_id, format_collapsed(stacks))
+                self.write_aggregate()
+
+    @contextmanager
+    def cprofile(self, request_id):
+        started = time.monotonic()
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.create_stats()
+            with self.cond:
+                # cProfile slows down the whole request, so all of it is accounted as overhead
+                self.add_overhead(time.monotonic() - started)
+            self.write("%s.prof" % request_id, marshal.dumps(profile.stats))
+
+    def start_sampler(self):
+        with self.cond:
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self.sample, name="profiler", daemon=True)
+                self.sampler.start()
+
+    def sample(self):
+        with self.cond:
+            while True:
+                # park while no request is profiled
+                self.cond.wait_for(lambda: self.active or self.stopped)
+                self.cond.wait(self.interval)
+                if self.stopped:
+                    return
+                if not self.active:
+                    continue
+                started = time.monotonic()
+                frames = sys._current_frames()
+                for thread_id, stacks in self.active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[collapse(frame)] += 1
+                self.add_overhead(time.monotonic() - started)
+
+    def merge(self, stacks):
+        for stack, count in stacks.items():
+            if stack in self.stacks or len(self.stacks) < self.max_stacks:
+                self.stacks[stack] += count
+            else:
+                self.stacks[TRUNCATED] += count
+
+    def write(self, name, data):
+        with self.write_lock:
+            if self.write_file(name, data):
+                self.files.append((name, len(data)))
+
+    def write_file(self, name, data, replaces=0):
+        # rotate out the oldest per-request profiles to stay under the disk budget
+        while self.files and self.bytes_written - replaces + len(data) > self.max_bytes:
+            old_name, size = self.files.popleft()
+            try:
+                os.remove(os.path.join(self.path, old_name))
+            except FileNotFoundError:
+                pass
+            self.bytes_written -= size
+        if self.bytes_written - replaces + len(data) > self.max_bytes:
+            logging.warning("Profiling disk budget of %i bytes is exhausted, skipping '%s'", self.max_bytes, name)
+            return False
+        started = time.monotonic()
+        filename = os.path.join(self.path, name)
+        with open(filename + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(filename + ".tmp", filename)
+        self.bytes_written += len(data) - replaces
+        with self.cond:
+            self.add_overhead(time.monotonic() - started)
+        return True
+
+    def write_aggregate(self, force=False):
+        with self.write_lock:
+            now = time.monotonic()
+            if not force and self.aggregate_written_at is not None and \
+                    now - self.aggregate_written_at < self.aggregate_interval:
+                return
+            started = time.monotonic()
+            with self.cond:
+                data = format_collapsed(self.stacks)
+                self.add_overhead(time.monotonic() - started)
+            if self.write_file(AGGREGATE_FILE, data, replaces=self.aggregate_size):
+                self.aggregate_size = len(data)
+                self.aggregate_written_at = now
+
+    def close(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        if self.sampler is not None:
+            self.sampler.join()
+        if self.stacks:
+            self.write_aggregate(force=True)
@@ -8,9 +8,13 @@ from field import (
     BirthDayField,
     GenderField,
     ArgumentsField,
+    InterestsField,
+    CursorField,
+    CountField,
 )
 
 ADMIN_LOGIN = "admin"
+OPERATORS = ("and", "or")
 
 class RequestValidationFailedError(Exception):
 
@@ -37,6 +41,18 @@ class ClientsInterestsRequest(Request):
     date = DateField(required=False, nullable=True)
 
 
+class ClientsByInterestsRequest(Request):
+    interests = InterestsField(required=True)
+    operator = CharField(required=False, nullable=True)
+    cursor = CursorField(required=False, nullable=True)
+    count = CountField(required=False, nullable=True)
+
+    def validate(self, kwargs):
+        super().validate(kwargs)
+        if self.operator and self.operator not in OPERATORS:
+            raise RequestValidationFailedError("operator must be one of {}".format(OPERATORS))
+
+
 class OnlineScoreRequest(Request):
     first_name = CharField(required=False, nullable=True)
     last_name = CharField(required=False, nullable=True)
@@ -1,5 +1,6 @@
 import hashlib
 import json
+import logging
 
 
 def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
@@ -31,3 +32,38 @@ def get_score(store, phone, email, birthday=None, gender=None, first_name=None,
 def get_interests(store, cid):
     r = store.get("i:%s" % cid)
     return json.loads(r) if r else []
+
+
+def set_interests(store, cid, interests):
+    def index_keys(old_value):
+        old_interests = set(json.loads(old_value)) if old_value else set()
+        return (
+            ["ii:%s" % interest for interest in set(interests)],
+            ["ii:%s" % interest for interest in old_interests - set(interests)],
+        )
+    store.set_indexed("i:%s" % cid, json.dumps(interests), cid, index_keys)
+
+
+def rebuild_interests_index(store):
+    store.delete(*store.scan("ii:*"), *store.scan("iq:*"))
+    for key in store.scan("i:*"):
+        try:
+            cid = int(key[2:])
+        except ValueError:
+            logging.warning("Skipping '%s' while rebuilding interests index, client id is not int", key)
+            continue
+        store.index_update(cid, ["ii:%s" % interest for interest in get_interests(store, cid)])
+
+
+def get_clients_by_interests(store, interests, union=False, cursor=None, count=100):
+    keys = sorted({"ii:%s" % interest for interest in interests})
+    if len(keys) == 1:
+        key = keys[0]
+    else:
+        # query result is kept for a while, so next pages are read from the same snapshot
+        key = "iq:%s:%s" % ("or" if union else "and", hashlib.md5("\0".join(keys).encode("utf-8")).hexdigest())
+        if cursor is None or not store.exists(key):
+            store.index_combine(key, keys, union, 60)
+    client_ids = store.index_range(key, cursor, count + 1)
+    next_cursor = client_ids.pop() if len(client_ids) > count else None
+    return client_ids, next_cursor
@@ -1,20 +1,38 @@
+import atexit
 import logging
+import threading
 from datetime import datetime, timedelta
+from functools import lru_cache
 from time import sleep
 
-import redis
-
 REDIS_HOST = "localhost"
 REDIS_PORT = "60722"
 MIN_DELAY = 0.1
 TRY_NUM = 3
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP = "drop"
+OVERFLOW_SYNC = "sync"
+OVERFLOWS = (OVERFLOW_BLOCK, OVERFLOW_DROP, OVERFLOW_SYNC)
+
+@lru_cache(maxsize=None)
+def redis_errors():
+    # redis is imported lazily to keep it out of the cold start path
+    import redis
+    return redis.exceptions.ConnectionError, redis.exceptions.TimeoutError
+
+
+@lru_cache(maxsize=None)
+def watch_error():
+    import redis
+    return redis.exceptions.WatchError
+
 
 def retry(func):
     def wrapper(*args, **kwargs):
         for try_id in range(TRY_NUM):
             try:
                 return func(*args, **kwargs)
-            except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError) as ex:
+            except redis_errors() as ex:
                 logging.info("Could not connect to Redis. Retrying.")
             sleep(MIN_DELAY * (try_id + 1))
         logging.error("Redis is not responding")
@@ -22,31 +40,227 @@ def retry(func):
     return wrapper
 
 
+class WriteBehindQueue:
+    """Bounded queue of pending writes, flushed in batches by a background thread.
+
+    Writes to the same key are coalesced so only the latest value is flushed.
+    When the queue is full the overflow policy decides what happens to a new key:
+    "block" waits for the next flush, "drop" discards the write and "sync" tells
+    the caller to write it synchronously.
+    """
+
+    def __init__(self, flush, max_size=10000, batch_size=500, flush_interval=0.05, overflow=OVERFLOW_BLOCK):
+        if overflow not in OVERFLOWS:
+            raise ValueError("Overflow policy must be one of {}, but got '{}'".format(OVERFLOWS, overflow))
+        self.flush = flush
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.pending = {}
+        self.flushing = {}
+        self.closed = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name="write-behind", daemon=True)
+        self.thread.start()
+
+    def get(self, key):
+        with self.cond:
+            for batch in (self.pending, self.flushing):
+                if key in batch:
+                    return True, batch[key][0]
+        return False, None
+
+    def put(self, key, value, expire=None):
+        """Queue a write, return False if the caller has to write it itself."""
+        with self.cond:
+            while not self.closed and key not in self.pending and len(self.pending) >= self.max_size:
+                if self.overflow == OVERFLOW_DROP:
+                    logging.warning("Write-behind queue is full, dropping '%s'", key)
+                    return True
+                # a direct write would be overwritten by the older value of an in-flight batch
+                if self.overflow == OVERFLOW_SYNC and key not in self.flushing:
+                    return False
+                self.cond.wait(self.flush_interval)
+            if self.closed:
+                while (key in self.pending or key in self.flushing) and self.thread.is_alive():
+                    self.cond.wait(self.flush_interval)
+                return False
+            self.pending[key] = (value, expire)
+            if len(self.pending) >= self.batch_size:
+                self.cond.notify_all()
+            return True
+
+    def discard(self, key):
+        """Drop a queued write of key and wait until no batch is writing it."""
+        with self.cond:
+            self.pending.pop(key, None)
+            while key in self.flushing and self.thread.is_alive():
+                self.cond.wait(self.flush_interval)
+
+    def run(self):
+        try:
+            while True:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.closed or len(self.pending) >= self.batch_size,
+                                       self.flush_interval)
+                    self.flushing, self.pending = self.pending, {}
+                    closed = self.closed
+                    self.cond.notify_all()
+                if self.flushing:
+                    try:
+                        self.flush(self.flushing)
+                    except Exception:
+                        logging.exception("Dropped %i queued writes", len(self.flushing))
+                    with self.cond:
+                        self.flushing = {}
+                        self.cond.notify_all()
+                if closed:
+                    return
+        finally:
+            # writers must not wait for a worker that is gone
+            with self.cond:
+                self.closed = True
+                self.cond.notify_all()
+
+    def close(self, timeout=None):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join(timeout)
+
+
 class Storage:
 
     def __init__(self, host=REDIS_HOST, port=REDIS_PORT):
         self.host = host
         self.port = port
         self.redis = None
+        self.write_behind = None
 
     @retry
     def connect(self):
+        import redis
         self.redis = redis.Redis(self.host, self.port, decode_responses=True)
 
+    def client(self):
+        if self.redis is None:
+            self.connect()
+        return self.redis
+
+    def enable_write_behind(self, **kwargs):
+        if self.write_behind is not None and not self.write_behind.closed:
+            raise RuntimeError("Write-behind is already enabled")
+        self.write_behind = WriteBehindQueue(self.flush, **kwargs)
+        atexit.register(self.close)
+
+    def close(self):
+        if self.write_behind is not None:
+            self.write_behind.close()
+            atexit.unregister(self.close)
+
     @retry
     def get(self, key):
+        if self.write_behind is not None:
+            queued, value = self.write_behind.get(key)
+            if queued:
+                return value
         logging.info("Trying to get '%s' value from cache", key)
-        value = self.redis.get(key)
-        if value:
+        value = self.client().get(key)
+        if isinstance(value, bytes):
             return value.decode()
         return value
 
 
     @retry
     def set(self, key, value, expire=None):
+        if value is None:
+            return
+        if not isinstance(value, str):
+            raise TypeError("Value must be str, but got '{}'".format(type(value).__name__))
+        if self.write_behind is not None and self.write_behind.put(key, value, expire):
+            return
         logging.info("Trying to set '%s' value to '%s' into cache", value, key)
-        if value is not None:
-            self.redis.set(key, value.encode(), expire)
+        self.client().set(key, value.encode(), expire)
+
+    @retry
+    def exists(self, key):
+        return bool(self.client().exists(key))
+
+    @retry
+    def scan(self, pattern):
+        return [key.decode() if isinstance(key, bytes) else key for key in self.client().scan_iter(pattern)]
+
+    @retry
+    def delete(self, *keys):
+        if keys:
+            self.client().delete(*keys)
+
+    @retry
+    def set_indexed(self, key, value, cid, index_keys):
+        """Set key and move cid between index sets in one transaction.
+
+        index_keys maps the current value of key to the (add_keys, remove_keys)
+        pair. The write bypasses write-behind so the value and the index
+        never diverge.
+        """
+        if self.write_behind is not None:
+            self.write_behind.discard(key)
+        pipe = self.client().pipeline()
+        try:
+            while True:
+                try:
+                    pipe.watch(key)
+                    old_value = pipe.get(key)
+                    if isinstance(old_value, bytes):
+                        old_value = old_value.decode()
+                    add_keys, remove_keys = index_keys(old_value)
+                    pipe.multi()
+                    pipe.set(key, value.encode())
+                    for index_key in remove_keys:
+                        pipe.zrem(index_key, cid)
+                    for index_key in add_keys:
+                        pipe.zadd(index_key, {cid: cid})
+                    pipe.execute()
+                    return
+                except watch_error():
+                    logging.info("'%s' changed during update, retrying", key)
+        finally:
+            pipe.reset()
+
+    @retry
+    def index_update(self, cid, add_keys=(), remove_keys=()):
+        pipe = self.client().pipeline()
+        for key in remove_keys:
+            pipe.zrem(key, cid)
+        for key in add_keys:
+            pipe.zadd(key, {cid: cid})
+        pipe.execute()
+
+    @retry
+    def index_combine(self, dest, keys, union=False, expire=None):
+        logging.info("Building '%s' from %s", dest, keys)
+        pipe = self.client().pipeline()
+        if union:
+            pipe.zunionstore(dest, keys, aggregate="MIN")
+        else:
+            pipe.zinterstore(dest, keys, aggregate="MIN")
+        if expire:
+            pipe.expire(dest, expire)
+        pipe.execute()
+
+    @retry
+    def index_range(self, key, start=None, count=100):
+        start = "-inf" if start is None else start
+        return [int(cid) for cid in self.client().zrangebyscore(key, start, "+inf", start=0, num=count)]
+
+    @retry
+    def flush(self, batch):
+        logging.debug("Flushing %i queued writes", len(batch))
+        pipe = self.client().pipeline(transaction=False)
+        for key, (value, expire) in batch.items():
+            pipe.set(key, value.encode(), expire)
+        pipe.execute()
 
 
 class Store(Storage):
@@ -18,6 +18,9 @@ from field import (
     BirthDayField,
     GenderField,
     ClientIDsField,
+    InterestsField,
+    CursorField,
+    CountField,
 )
 
 
@@ -75,6 +78,16 @@ class TestFields(TestCase):
         ("ClientIDsField valid value", ClientIDsField, [1, 2, 3], None),
         ("ClientIDsField invalid value wrong type", ClientIDsField, 100500, FieldValidationError),
         ("ClientIDsField invalid value wrong type inside list", ClientIDsField, ["1", "2", "3"], FieldValidationError),
+        ("InterestsField valid value", InterestsField, ["cars", "pets"], None),
+        ("InterestsField invalid value wrong type", InterestsField, "cars", FieldValidationError),
+        ("InterestsField invalid value empty item", InterestsField, ["cars", ""], FieldValidationError),
+        ("CursorField valid value", CursorField, 100, None),
+        ("CursorField invalid value wrong type", CursorField, "100", FieldValidationError),
+        ("CursorField valid value negative", CursorField, -1, None),
+        ("CountField valid value", CountField, 100, None),
+        ("CountField invalid value zero", CountField, 0, FieldValidationError),
+        ("CountField invalid value negative", CountField, -1, FieldValidationError),
+        ("CountField invalid value too big", CountField, 100500, FieldValidationError),
     ])
     def test_Fields(self, check_name, cls, test_value, ex):
         if ex:
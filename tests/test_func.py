@@ -2,6 +2,7 @@ import datetime
 import hashlib
 import json
 import random
+import threading
 from unittest import TestCase, mock
 import fakeredis
 
@@ -9,7 +10,8 @@ from parameterized import parameterized
 
 import api
 import req
-from store import Store, Storage
+import scoring
+from store import Store, Storage, OVERFLOW_DROP
 
 INTERESTS = ["cars", "pets", "travel", "hi-tech", "sport", "music",
              "books", "tv", "cinema", "geek", "otus"]
@@ -150,3 +152,104 @@ class TestSuite(TestCase):
         self.assertTrue(
             all(v and isinstance(v, list) and all(isinstance(i, str) for i in v) for v in response.values()))
         self.assertEqual(self.context.get("nclients"), len(arguments["client_ids"]))
+
+    @parameterized.expand([
+        ("null", {}),
+        ("interests missing", {"operator": "and"}),
+        ("wrong interests type", {"interests": "cars"}),
+        ("wrong interests items type", {"interests": [1, 2]}),
+        ("wrong operator", {"interests": ["cars"], "operator": "xor"}),
+        ("wrong cursor type", {"interests": ["cars"], "cursor": "1"}),
+        ("zero count", {"interests": ["cars"], "count": 0}),
+        ("too big count", {"interests": ["cars"], "count": 100500}),
+    ])
+    def test_invalid_clients_by_interests_request(self, case_name, arguments):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_by_interests", "arguments": arguments}
+        self.set_valid_auth(request)
+        response, code = self.get_response(request)
+        self.assertEqual(api.INVALID_REQUEST, code, arguments)
+        self.assertTrue(len(response))
+
+    @parameterized.expand([
+        ("single interest", {"interests": ["cars"]}, [1, 3, 4]),
+        ("intersection", {"interests": ["cars", "pets"]}, [1, 4]),
+        ("explicit intersection", {"interests": ["cars", "pets"], "operator": "and"}, [1, 4]),
+        ("union", {"interests": ["cars", "pets"], "operator": "or"}, [1, 2, 3, 4]),
+        ("unknown interest", {"interests": ["cars", "otus"]}, []),
+    ])
+    def test_ok_clients_by_interests_request(self, case_name, arguments, expected):
+        for cid, interests in {1: ["cars", "pets"], 2: ["pets"], 3: ["cars", "books"], 4: ["pets", "cars"]}.items():
+            scoring.set_interests(self.store, cid, interests)
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_by_interests", "arguments": arguments}
+        self.set_valid_auth(request)
+        response, code = self.get_response(request)
+        self.assertEqual(api.OK, code, arguments)
+        self.assertEqual(response, {"client_ids": expected, "cursor": None})
+        self.assertEqual(self.context.get("ninterests"), len(arguments["interests"]))
+
+    def test_clients_by_interests_cursor(self):
+        for cid in range(10, 25):
+            scoring.set_interests(self.store, cid, ["cars", "pets"] if cid % 2 else ["cars"])
+        scoring.set_interests(self.store, 11, ["cars"])
+        scoring.set_interests(self.store, -5, ["cars", "pets"])
+        client_ids, arguments = [], {"interests": ["pets", "cars"], "count": 2}
+        while True:
+            request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_by_interests",
+                       "arguments": arguments}
+            self.set_valid_auth(request)
+            response, code = self.get_response(request)
+            self.assertEqual(api.OK, code)
+            self.assertLessEqual(len(response["client_ids"]), 2)
+            client_ids += response["client_ids"]
+            if response["cursor"] is None:
+                break
+            arguments["cursor"] = response["cursor"]
+        self.assertEqual(client_ids, [-5, 13, 15, 17, 19, 21, 23])
+
+    def test_set_interests_updates_index(self):
+        scoring.set_interests(self.store, 100, ["cars", "pets"])
+        scoring.set_interests(self.store, 100, ["pets", "books"])
+        self.assertEqual(scoring.get_interests(self.store, 100), ["pets", "books"])
+        self.assertNotIn(100, scoring.get_clients_by_interests(self.store, ["cars"])[0])
+        self.assertIn(100, scoring.get_clients_by_interests(self.store, ["pets", "books"])[0])
+
+    def test_concurrent_set_interests(self):
+        def update():
+            for _ in range(20):
+                scoring.set_interests(self.store, 100, random.sample(INTERESTS, 2))
+
+        threads = [threading.Thread(target=update) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        interests = scoring.get_interests(self.store, 100)
+        for interest in INTERESTS:
+            client_ids = scoring.get_clients_by_interests(self.store, [interest])[0]
+            self.assertEqual(100 in client_ids, interest in interests, interest)
+
+    def test_negative_client_ids(self):
+        scoring.set_interests(self.store, -5, ["cars"])
+        scoring.set_interests(self.store, 7, ["cars"])
+        self.assertEqual(scoring.get_clients_by_interests(self.store, ["cars"]), ([-5, 7], None))
+
+    def test_set_interests_with_write_behind(self):
+        self.store.enable_write_behind(max_size=1, flush_interval=60, overflow=OVERFLOW_DROP)
+        self.addCleanup(self.store.close)
+        self.store.set("other", "queued")
+        scoring.set_interests(self.store, 100, ["cars"])
+        scoring.set_interests(self.store, 100, ["pets"])
+        self.assertEqual(self.store.redis.get("i:100"), b'["pets"]')
+        self.assertEqual(scoring.get_clients_by_interests(self.store, ["cars"]), ([], None))
+        self.assertEqual(scoring.get_clients_by_interests(self.store, ["pets"]), ([100], None))
+
+    def test_rebuild_interests_index(self):
+        scoring.set_interests(self.store, 100, ["cars"])
+        self.store.redis.set("i:100", json.dumps(["pets"]))
+        self.store.redis.set("i:bad", json.dumps(["cars"]))
+        scoring.rebuild_interests_index(self.store)
+        self.assertNotIn(100, scoring.get_clients_by_interests(self.store, ["cars"])[0])
+        self.assertIn(100, scoring.get_clients_by_interests(self.store, ["pets"])[0])
+        for cid in range(10):
+            for interest in scoring.get_interests(self.store, cid):
+                self.assertIn(cid, scoring.get_clients_by_interests(self.store, [interest])[0])
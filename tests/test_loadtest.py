@@ -0,0 +1,79 @@
+import json
+from unittest import TestCase
+
+import fakeredis
+import redis
+from parameterized import parameterized
+
+import api
+import loadtest
+import scoring
+
+
+class TestLoadTest(TestCase):
+
+    @parameterized.expand([
+        ("empty", [], 50, 0.0),
+        ("median", [1, 2, 3, 4], 50, 2),
+        ("p99", list(range(1, 101)), 99, 99),
+        ("max", [3, 1, 2], 100, 3),
+    ])
+    def test_percentile(self, case_name, values, p, expected):
+        self.assertEqual(loadtest.percentile(values, p), expected)
+
+    def test_parse_mix(self):
+        self.assertEqual(loadtest.parse_mix("online_score=2,admin"), {"online_score": 2.0, "admin": 1.0})
+        with self.assertRaises(ValueError):
+            loadtest.parse_mix("unknown=1")
+
+    def test_flaky_redis_failure(self):
+        client = loadtest.FlakyRedis(fakeredis.FakeRedis(), failure_rate=1.0)
+        with self.assertRaises(redis.exceptions.ConnectionError):
+            client.get("key")
+
+    @parameterized.expand([(kind,) for kind in loadtest.KINDS])
+    def test_make_request(self, kind):
+        store = loadtest.make_store(10)
+        response, code = api.method_handler({"body": loadtest.make_request(kind, 10, 5), "headers": {}}, {}, store)
+        self.assertEqual(api.OK, code, response)
+
+    def test_run(self):
+        opts, _ = loadtest.get_option_parser().parse_args(["-c", "2", "-d", "0.2", "--clients", "10"])
+        stats = loadtest.run(opts)
+        self.assertGreater(stats.total(), 0)
+        self.assertEqual(stats.errors(), 0)
+        self.assertIn("req/s", stats.report())
+
+    def test_flaky_redis_pipeline_failure(self):
+        client = loadtest.FlakyRedis(fakeredis.FakeRedis())
+        pipe = client.pipeline()
+        pipe.set("key", "value")
+        client.failure_rate = 1.0
+        with self.assertRaises(redis.exceptions.ConnectionError):
+            pipe.execute()
+
+    @parameterized.expand([
+        ("bytes responses", False),
+        ("decoded responses", True),
+    ])
+    def test_decoded_responses_client(self, case_name, decode_responses):
+        store = loadtest.make_store(10)
+        store.redis = fakeredis.FakeRedis(decode_responses=decode_responses)
+        scoring.set_interests(store, 1, ["cars", "pets"])
+        request = loadtest.make_request("clients_interests", 2, 2)
+        response, code = api.method_handler({"body": request, "headers": {}}, {}, store)
+        self.assertEqual(api.OK, code, response)
+        self.assertEqual(scoring.get_interests(store, 1), ["cars", "pets"])
+
+    @parameterized.expand([(kind,) for kind in loadtest.KINDS])
+    def test_check_response(self, kind):
+        store = loadtest.make_store(10)
+        request = loadtest.make_request(kind, 10, 5)
+        response, code = api.method_handler({"body": request, "headers": {}}, {}, store)
+        # the harness checks bodies after the JSON round trip
+        self.assertTrue(loadtest.check_response(request, json.loads(json.dumps(response))))
+
+    def test_check_response_other_clients(self):
+        request = loadtest.make_request("clients_interests", 10, 5)
+        response = {str(cid + 1): loadtest.seeded_interests(cid + 1) for cid in request["arguments"]["client_ids"]}
+        self.assertFalse(loadtest.check_response(request, response))
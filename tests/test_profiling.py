@@ -0,0 +1,150 @@
+import os
+import sys
+import tempfile
+import time
+from unittest import TestCase
+
+from parameterized import parameterized
+
+from profiling import (
+    AGGREGATE_FILE,
+    MODE_CPROFILE,
+    PROFILE_HEADER,
+    Profiler,
+    collapse,
+)
+
+
+def busy(duration=0.05):
+    started = time.monotonic()
+    while time.monotonic() - started < duration:
+        pass
+
+
+class TestProfiling(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+        self.addCleanup(self.tmp.cleanup)
+
+    def make_profiler(self, **kwargs):
+        kwargs.setdefault("max_overhead", 1.0)
+        profiler = Profiler(self.path, **kwargs)
+        self.addCleanup(profiler.close)
+        return profiler
+
+    def test_collapse(self):
+        self.assertTrue(collapse(sys._getframe()).endswith("test_profiling.py:test_collapse"))
+
+    def test_not_sampled(self):
+        profiler = self.make_profiler()
+        with profiler.profile("req1", {}):
+            busy()
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_header(self):
+        profiler = self.make_profiler(header_token="secret")
+        with profiler.profile("req1", {PROFILE_HEADER: "secret"}):
+            busy()
+        self.assertEqual(sorted(os.listdir(self.path)), [AGGREGATE_FILE, "req1.collapsed"])
+        with open(os.path.join(self.path, AGGREGATE_FILE)) as f:
+            self.assertIn("test_profiling.py:busy", f.read())
+
+    def test_rate(self):
+        profiler = self.make_profiler(rate=1.0)
+        with profiler.profile("req1"):
+            busy()
+        self.assertIn("req1.collapsed", os.listdir(self.path))
+
+    def test_unsafe_request_id(self):
+        profiler = self.make_profiler(rate=1.0)
+        with profiler.profile("../../etc/passwd"):
+            busy()
+        self.assertNotIn("passwd", " ".join(os.listdir(self.path)))
+
+    def test_cprofile(self):
+        profiler = self.make_profiler(rate=1.0, mode=MODE_CPROFILE)
+        with profiler.profile("req1"):
+            busy()
+        self.assertEqual(os.listdir(self.path), ["req1.prof"])
+
+    def test_max_concurrent(self):
+        profiler = self.make_profiler(rate=1.0, max_concurrent=1)
+        with profiler.profile("req1"):
+            with profiler.profile("req2"):
+                busy()
+        self.assertNotIn("req2.collapsed", os.listdir(self.path))
+
+    @parameterized.expand([
+        ("no token configured", None, "1"),
+        ("zero", "secret", "0"),
+        ("wrong token", "secret", "guess"),
+    ])
+    def test_header_not_forced(self, case_name, header_token, header):
+        profiler = self.make_profiler(header_token=header_token)
+        with profiler.profile("req1", {PROFILE_HEADER: header}):
+            busy()
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_max_overhead(self):
+        profiler = self.make_profiler(rate=1.0, max_overhead=0.1, overhead_window=10)
+        with profiler.cond:
+            profiler.add_overhead(2.0)
+        with profiler.profile("req1"):
+            busy()
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_overhead_window_slides(self):
+        profiler = self.make_profiler(rate=1.0, max_overhead=0.1, overhead_window=10)
+        with profiler.cond:
+            profiler.add_overhead(2.0)
+            profiler.overhead_buckets[0][0] -= 60
+        with profiler.profile("req1"):
+            busy()
+        self.assertIn("req1.collapsed", os.listdir(self.path))
+
+    def test_max_bytes(self):
+        profiler = self.make_profiler(rate=1.0, max_bytes=1)
+        with profiler.profile("req1"):
+            busy()
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_disk_budget_across_restarts(self):
+        for i in range(3):
+            with open(os.path.join(self.path, "old%i.collapsed" % i), "wb") as f:
+                f.write(b"x" * 400)
+            os.utime(os.path.join(self.path, "old%i.collapsed" % i), (i, i))
+        profiler = self.make_profiler(rate=1.0, max_bytes=1500, aggregate_interval=60)
+        self.assertEqual(profiler.bytes_written, 1200)
+        with profiler.profile("req1"):
+            busy()
+        files = os.listdir(self.path)
+        self.assertNotIn("old0.collapsed", files)
+        self.assertIn(AGGREGATE_FILE, files)
+        self.assertLessEqual(sum(os.path.getsize(os.path.join(self.path, name)) for name in files), 1500)
+
+    def test_sampler_parks_when_idle(self):
+        profiler = self.make_profiler(rate=1.0)
+        with profiler.profile("req1"):
+            busy()
+        overhead = profiler.overhead
+        time.sleep(0.05)
+        self.assertEqual(profiler.overhead, overhead)
+
+    def test_aggregate_throttled(self):
+        profiler = self.make_profiler(rate=1.0, aggregate_interval=60)
+        with profiler.profile("req1"):
+            busy()
+        aggregate = os.path.join(self.path, AGGREGATE_FILE)
+        size = os.path.getsize(aggregate)
+        with profiler.profile("req2"):
+            busy()
+        self.assertEqual(os.path.getsize(aggregate), size)
+        profiler.close()
+        with open(aggregate) as f:
+            self.assertEqual(sum(int(line.rsplit(" ", 1)[1]) for line in f), sum(profiler.stacks.values()))
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            Profiler(self.path, mode="unknown")
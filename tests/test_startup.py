@@ -0,0 +1,45 @@
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+from http.client import HTTPConnection
+from unittest import TestCase
+
+import api
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLD_START = """
+import sys
+import api
+print("redis" in sys.modules, "http.server" in sys.modules)
+"""
+
+
+class TestStartup(TestCase):
+
+    def test_no_heavy_imports(self):
+        output = subprocess.check_output([sys.executable, "-c", COLD_START], cwd=ROOT, text=True)
+        self.assertEqual(output.split(), ["False", "False"])
+
+    def test_create_app(self):
+        first, second = api.create_app(), api.create_app()
+        self.assertTrue(issubclass(first, api.MainHTTPHandler))
+        self.assertIsNot(first.store, second.store)
+        self.assertIsNone(first.store.redis)
+
+    def test_main_handler_default_store(self):
+        from http.server import HTTPServer
+        handler = type("Handler", (api.MainHTTPHandler,), {"log_message": lambda self, *args: None})
+        server = HTTPServer(("localhost", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        body = {"account": "a", "login": "b", "method": "online_score",
+                "arguments": {"first_name": "a", "last_name": "b"},
+                "token": hashlib.sha512(("ab" + api.SALT).encode("utf-8")).hexdigest()}
+        conn = HTTPConnection(*server.server_address)
+        conn.request("POST", "/method/", json.dumps(body))
+        self.assertEqual(json.loads(conn.getresponse().read())["code"], api.OK)
+        self.assertIsNotNone(handler.store)
@@ -1,9 +1,11 @@
+import threading
 from unittest import TestCase
 
 import fakeredis
+import redis
 from datetime import datetime, timedelta
 
-from store import Store, Storage
+from store import Store, Storage, WriteBehindQueue, OVERFLOW_DROP, OVERFLOW_SYNC
 
 INTERESTS = ["cars", "pets", "travel", "hi-tech", "sport", "music",
              "books", "tv", "cinema", "geek", "otus"]
@@ -45,3 +47,108 @@ class TestStore(TestCase):
     def test_cache_expired(self):
         self.store.cache_set("cache_test", "expire_test", 0.000001)
         self.assertIsNone(self.store.cache_get("cache_test"))
+
+
+class TestWriteBehind(TestCase):
+
+    def setUp(self):
+        self.store = Store(Storage())
+        self.server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=self.server)
+        self.store.redis = self.redis
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_coalesce_and_drain_on_close(self):
+        self.store.enable_write_behind(flush_interval=60)
+        self.store.set("test", "first")
+        self.store.set("test", "last")
+        self.assertIsNone(self.redis.get("test"))
+        self.assertEqual(self.store.get("test"), "last")
+        self.store.close()
+        self.assertEqual(self.redis.get("test"), b"last")
+
+    def test_flush_on_batch_size(self):
+        self.store.enable_write_behind(batch_size=2, flush_interval=60)
+        self.store.set("a", "1")
+        self.store.set("b", "2")
+        self.store.write_behind.close(timeout=1)
+        self.assertEqual(self.redis.mget("a", "b"), [b"1", b"2"])
+
+    def test_overflow_drop(self):
+        self.store.enable_write_behind(max_size=1, flush_interval=60, overflow=OVERFLOW_DROP)
+        self.store.set("a", "1")
+        self.store.set("b", "2")
+        self.store.close()
+        self.assertEqual(self.redis.mget("a", "b"), [b"1", None])
+
+    def test_overflow_sync(self):
+        self.store.enable_write_behind(max_size=1, flush_interval=60, overflow=OVERFLOW_SYNC)
+        self.store.set("a", "1")
+        self.store.set("b", "2")
+        self.assertEqual(self.redis.mget("a", "b"), [None, b"2"])
+
+    def test_server_down(self):
+        self.store.enable_write_behind(flush_interval=60)
+        self.server.connected = False
+        self.store.set("test", "lost")
+        self.store.close()
+        self.server.connected = True
+        self.assertIsNone(self.redis.get("test"))
+
+    def test_invalid_overflow(self):
+        with self.assertRaises(ValueError):
+            self.store.enable_write_behind(overflow="unknown")
+
+    def test_bad_batch_does_not_stop_flushes(self):
+        flushed, failed = [], threading.Event()
+
+        def flush(batch):
+            if not failed.is_set():
+                failed.set()
+                raise redis.exceptions.ResponseError("Injected error")
+            flushed.append(dict(batch))
+
+        queue = WriteBehindQueue(flush, batch_size=1, flush_interval=60)
+        queue.put("a", "1")
+        failed.wait(1)
+        queue.put("b", "2")
+        queue.close(timeout=1)
+        self.assertFalse(queue.thread.is_alive())
+        self.assertEqual(flushed, [{"b": ("2", None)}])
+
+    def test_non_str_value(self):
+        with self.assertRaises(TypeError):
+            self.store.set("test", 5)
+        self.store.enable_write_behind(flush_interval=60)
+        with self.assertRaises(TypeError):
+            self.store.set("test", 5)
+
+    def test_overflow_sync_key_in_flight(self):
+        release, started = threading.Event(), threading.Event()
+        flush = self.store.flush
+
+        def slow_flush(batch):
+            started.set()
+            release.wait(1)
+            flush(batch)
+
+        self.store.flush = slow_flush
+        self.store.enable_write_behind(max_size=1, batch_size=1, flush_interval=60, overflow=OVERFLOW_SYNC)
+        self.store.set("a", "old")
+        started.wait(1)
+        self.store.set("b", "1")
+        writer = threading.Thread(target=self.store.set, args=("a", "new"))
+        writer.start()
+        release.set()
+        writer.join(1)
+        self.store.close()
+        self.assertEqual(self.redis.get("a"), b"new")
+
+    def test_enable_twice(self):
+        self.store.enable_write_behind(flush_interval=60)
+        with self.assertRaises(RuntimeError):
+            self.store.enable_write_behind(flush_interval=60)
+        self.store.close()
+        self.store.enable_write_behind(flush_interval=60)